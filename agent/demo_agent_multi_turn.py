@@ -14,20 +14,17 @@ load_dotenv()
 memory = MemorySaver()
 
 # Compiler le graphe avec mémoire
-# Note: On recompile ici avec un checkpointer pour la démo locale
-# (différent du graph.py qui n'a pas de checkpointer pour langgraph dev)
-from graph import StateGraph, END, process_message
-
-workflow = StateGraph(State)
-workflow.add_node("process_message", process_message)
-workflow.set_entry_point("process_message")
-workflow.add_edge("process_message", END)
-agent_with_memory = workflow.compile(checkpointer=memory)
+# Note: même construction que graph.py, avec un checkpointer pour la démo locale
+# (le graphe exporté pour langgraph dev n'a pas de checkpointer)
+agent_with_memory = build_graph(memory)
 
 # Thread ID pour la conversation
 thread_id = "demo-42"
 config = {"configurable": {"thread_id": thread_id}}
 
+# Checkpoint écrit une seule fois en fin d'exécution (pas à chaque super-step)
+DURABILITY = "exit"
+
 
 async def run():
     print("\n" + "="*60)
@@ -37,7 +34,7 @@ async def run():
     # Tour 1
     print("🗣️  Utilisateur: Je cherche des vacances à la montagne")
     state1 = State(dernier_message_utilisateur="Je cherche des vacances à la montagne")
-    res1 = await agent_with_memory.ainvoke(state1, config=config)
+    res1 = await agent_with_memory.ainvoke(state1, config=config, durability=DURABILITY)
     print(f"🤖 Agent: {res1['dernier_message_ia']}\n")
     print(f"📊 Critères identifiés: {res1['criteres']}\n")
     print("-"*60 + "\n")
@@ -45,7 +42,7 @@ async def run():
     # Tour 2
     print("🗣️  Utilisateur: J'aime le sport")
     state2 = State(dernier_message_utilisateur="J'aime le sport")
-    res2 = await agent_with_memory.ainvoke(state2, config=config)
+    res2 = await agent_with_memory.ainvoke(state2, config=config, durability=DURABILITY)
     print(f"🤖 Agent: {res2['dernier_message_ia']}\n")
     print(f"📊 Critères identifiés: {res2['criteres']}\n")
     print("-"*60 + "\n")
@@ -53,7 +50,7 @@ async def run():
     # Tour 3
     print("🗣️  Utilisateur: Est-ce accessible aux personnes handicapées?")
     state3 = State(dernier_message_utilisateur="Est-ce accessible aux personnes handicapées?")
-    res3 = await agent_with_memory.ainvoke(state3, config=config)
+    res3 = await agent_with_memory.ainvoke(state3, config=config, durability=DURABILITY)
     print(f"🤖 Agent: {res3['dernier_message_ia']}\n")
     print(f"📊 Critères identifiés: {res3['criteres']}\n")
     print("-"*60 + "\n")
@@ -61,4 +58,10 @@ async def run():
     print("✅ Demo terminée avec succès!")
 
 if __name__ == "__main__":
-    asyncio.run(run())
+    # uvloop (boucle libuv, plus rapide) si installé - sinon asyncio standard
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(run())
+    else:
+        uvloop.run(run())
@@ -10,12 +10,18 @@ INTÉGRATION LANGSMITH pour monitoring et traçabilité
 
 from __future__ import annotations
 import os
+import re
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 from dataclasses import dataclass, field
+from functools import lru_cache
+from string import Formatter
 from typing import Any, Dict, Optional
 
 from pydantic import BaseModel, Field
 from langchain.chat_models import init_chat_model
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, END
 from langsmith import traceable
 # =============================
@@ -42,18 +48,7 @@ LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "false")
 LANGSMITH_PROJECT = os.getenv("LANGSMITH_PROJECT", "voyage-agent-examen")
 LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
 
-# Affichage de l'état de LangSmith (lecture depuis .env uniquement)
-if LANGSMITH_TRACING.lower() == "true":
-    LANGSMITH_ENABLED = True
-    print("✅ LangSmith activé depuis .env - Traçage des opérations")
-    print(f"   Projet: {LANGSMITH_PROJECT}")
-    
-    if not LANGSMITH_API_KEY:
-        print("⚠️  ATTENTION: LANGSMITH_API_KEY non définie dans .env")
-        print("   Le traçage ne fonctionnera pas sans clé API")
-else:
-    LANGSMITH_ENABLED = False
-    print("⚠️  LangSmith désactivé - Définir LANGSMITH_TRACING=true dans .env")
+LANGSMITH_ENABLED = LANGSMITH_TRACING.lower() == "true"
 
 
 # =============================
@@ -63,14 +58,39 @@ else:
 # Variable d'environnement requise pour Mistral AI (à définir dans .env)
 # MISTRAL_API_KEY=votre_clé_api_mistral
 
-# Vérification de la clé API Mistral
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 
-if not MISTRAL_API_KEY:
-    print("❌ ERREUR: MISTRAL_API_KEY non définie")
-    print("   Ajoutez MISTRAL_API_KEY=votre_clé dans le fichier .env")
-    raise ValueError("MISTRAL_API_KEY est requis pour utiliser le modèle Mistral AI")
-else:
+# Option (A/B test) : présenter le voyage trouvé avec une réponse gabarit,
+# sans appel LLM de génération
+# REPONSES_DETERMINISTES=true
+REPONSES_DETERMINISTES = os.getenv("REPONSES_DETERMINISTES", "false").lower() == "true"
+
+
+@lru_cache(maxsize=1)
+def _configurer() -> None:
+    """Vérifie la configuration et affiche son état
+
+    Appelée par build_graph(), donc aussi à l'import via l'export `graph`
+    en bas de module. Mémorisée : les build_graph() suivants (ex: avec un
+    checkpointer) ne répètent pas les affichages. Un rechargement du module
+    (importlib.reload) les affiche à nouveau.
+    """
+    # Affichage de l'état de LangSmith (lecture depuis .env uniquement)
+    if LANGSMITH_ENABLED:
+        print("✅ LangSmith activé depuis .env - Traçage des opérations")
+        print(f"   Projet: {LANGSMITH_PROJECT}")
+        
+        if not LANGSMITH_API_KEY:
+            print("⚠️  ATTENTION: LANGSMITH_API_KEY non définie dans .env")
+            print("   Le traçage ne fonctionnera pas sans clé API")
+    else:
+        print("⚠️  LangSmith désactivé - Définir LANGSMITH_TRACING=true dans .env")
+    
+    # Vérification de la clé API Mistral
+    if not MISTRAL_API_KEY:
+        print("❌ ERREUR: MISTRAL_API_KEY non définie")
+        print("   Ajoutez MISTRAL_API_KEY=votre_clé dans le fichier .env")
+        raise ValueError("MISTRAL_API_KEY est requis pour utiliser le modèle Mistral AI")
     print("✅ Clé API Mistral configurée")
 
 
@@ -79,14 +99,62 @@ else:
 # =============================
 
 class Criteres(BaseModel):
-    """Schéma pour l'extraction structurée des critères"""
-    plage: Optional[bool] = Field(None, description="Vacances à la plage, mer, océan")
-    montagne: Optional[bool] = Field(None, description="Vacances en montagne, ski, altitude")
-    ville: Optional[bool] = Field(None, description="Vacances en ville, urbain, métropole")
+    """Critères de voyage du message : true = souhaité explicitement,
+    false = refusé explicitement (pas de, sans, éviter), null = non mentionné
+    """
+    plage: Optional[bool] = Field(None, description="Plage, mer, océan, côte, baignade")
+    montagne: Optional[bool] = Field(None, description="Montagne, ski, altitude")
+    ville: Optional[bool] = Field(None, description="Ville, urbain, métropole")
     sport: Optional[bool] = Field(None, description="Activités sportives, randonnée")
-    detente: Optional[bool] = Field(None, description="Séjour détente, repos, spa")
+    detente: Optional[bool] = Field(None, description="Détente, repos, spa")
     acces_handicap: Optional[bool] = Field(None, description="Accessibilité PMR, handicap")
 
+# Noms des critères, dans l'ordre du schéma (lecture directe des attributs
+# au lieu de .dict() qui re-sérialise tout le modèle Pydantic)
+_CRITERE_FIELDS = tuple(Criteres.model_fields)
+
+# Critères remis à zéro : gabarit copié (dict.copy) plutôt que reconstruit
+_CRITERES_VIDES: Dict[str, Optional[bool]] = dict.fromkeys(_CRITERE_FIELDS)
+
+
+
+# =============================
+#   MODÈLES (instanciés une seule fois)
+# =============================
+
+# Plafond de tokens pour la réponse conseiller (3-4 phrases courtes)
+MAX_TOKENS_GENERATION = 300
+
+# Température basse et explicite : extractions et réponses sont mises en
+# cache (CACHE_EXTRACTION / CACHE_GENERATION), une réponse servie à plusieurs
+# utilisateurs doit rester quasi déterministe (≤ 0.3)
+TEMPERATURE_LLM = 0.3
+
+
+@lru_cache(maxsize=1)
+def _get_model():
+    """Retourne le modèle Mistral partagé entre tous les tours"""
+    return init_chat_model(
+        "mistral-small-latest",
+        model_provider="mistralai",
+        temperature=TEMPERATURE_LLM,
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_generation_model():
+    """Retourne le modèle de génération, borné en tokens de sortie
+
+    La réponse attendue fait 3-4 phrases : plafonner max_tokens évite qu'une
+    génération trop longue allonge la latence du tour.
+    """
+    return _get_model().bind(max_tokens=MAX_TOKENS_GENERATION)
+
+
+@lru_cache(maxsize=1)
+def _get_struct_model():
+    """Retourne le modèle lié au schéma Criteres (structured output)"""
+    return _get_model().with_structured_output(Criteres)
 
 
 # =============================
@@ -98,17 +166,7 @@ class State:
     """État de l'agent - Stocke uniquement le dernier échange"""
     dernier_message_utilisateur: str = ""
     dernier_message_ia: str = ""
-    criteres: Dict[str, Optional[bool]] = field(
-        default_factory=lambda: {
-            "plage": None,
-            "montagne": None,
-            "ville": None,
-            "sport": None,
-            "detente": None,
-            "acces_handicap": None,
-          
-        }
-    )
+    criteres: Dict[str, Optional[bool]] = field(default_factory=_CRITERES_VIDES.copy)
 
 
 # =============================
@@ -116,60 +174,122 @@ class State:
 # =============================
 # Ordre optimisé : voyages "premium" / spécifiques en priorité
 
-VOYAGES = [
+# Catalogue figé : tuple de voyages, labels en tuple. Les voyages restent des
+# dict simples pour être sérialisés en JSON dans les traces LangSmith
+VOYAGES = (
     {
         "nom": "5 étoiles à Chamonix option ski",
-        "labels": ["montagne", "sport"],
+        "labels": ("montagne", "sport"),
         "accessibleHandicap": False,
     
     },
     {
         "nom": "5 étoiles à Chamonix option fondue",
-        "labels": ["montagne", "detente",],
+        "labels": ("montagne", "detente",),
         "accessibleHandicap": True
     },
     {
         "nom": "Palavas de paillotes en paillotes",
-        "labels": ["plage", "ville", "detente", "paillote"],
+        "labels": ("plage", "ville", "detente", "paillote"),
         "accessibleHandicap": True
     },
     {
         "nom": "5 étoiles en rase campagne",
-        "labels": ["campagne", "detente"],
+        "labels": ("campagne", "detente"),
         "accessibleHandicap": True
     },
     {
         "nom": "Randonnée camping en Lozère",
-        "labels": ["sport", "montagne", "campagne"],
+        "labels": ("sport", "montagne", "campagne"),
         "accessibleHandicap": False
     }
-]
+)
+
+# Extraits formatés une fois par voyage (labels, accessibilité) pour les
+# prompts et réponses : nom du voyage → (labels joints, "Oui"/"Non")
+FICHES_VOYAGES = {
+    v["nom"]: (", ".join(v["labels"]), "Oui" if v["accessibleHandicap"] else "Non")
+    for v in VOYAGES
+}
 
 
 # =============================
-#   PROMPTS
+#   INDEX BITMASK DU CATALOGUE
 # =============================
+# Chaque label pertinent occupe un bit : le matching se réduit à une expression "^ &"
+
+LABEL_BITS = {
+    "plage": 1,
+    "montagne": 2,
+    "ville": 4,
+    "sport": 8,
+    "detente": 16,
+    "détente": 16,
+}
+
+
+def _masque_labels(labels) -> int:
+    """Encode une liste de labels en masque d'entiers (labels inconnus ignorés)"""
+    masque = 0
+    for label in labels:
+        masque |= LABEL_BITS.get(label, 0)
+    return masque
+
+
+# Mapping critère → label utilisé par le scoring (constant, construit une fois)
+LABEL_MAP_SCORE = {
+    "plage": "plage",
+    "montagne": "montagne",
+    "ville": "ville",
+    "sport": "sport",
+    "detente": "detente"
+}
+LABELS_PERTINENTS = frozenset(LABEL_MAP_SCORE.values())
+
+# Bit 5 (valeur 32) réservé à l'accessibilité handicap, au-dessus des labels
+BIT_ACCES = 32
+
+# Bit associé à chaque critère du schéma (labels + accessibilité)
+CRITERE_BITS = {
+    critere: BIT_ACCES if critere == "acces_handicap" else LABEL_BITS[critere]
+    for critere in _CRITERE_FIELDS
+}
+
+# (masque labels + accessibilité, nb de labels pertinents) par voyage,
+# dans l'ordre de VOYAGES
+VOYAGE_MASKS = tuple(
+    (
+        _masque_labels(v["labels"]) | (BIT_ACCES if v["accessibleHandicap"] else 0),
+        sum(1 for label in v["labels"] if label in LABELS_PERTINENTS),
+    )
+    for v in VOYAGES
+)
 
-PROMPT_EXTRACTION = """Tu es un extracteur de critères de voyage.
 
-CRITÈRES (6 clés JSON obligatoires) :
-- montagne, plage,  ville, sport, detente, acces_handicap
+def masques_criteres(criteres: Dict) -> tuple:
+    """Convertit les critères en (masque des valeurs True, masque des critères renseignés)"""
+    valeurs = 0
+    definis = 0
+    for critere, valeur in criteres.items():
+        if valeur is None:
+            continue
+        bit = CRITERE_BITS.get(critere, 0)
+        definis |= bit
+        if valeur:
+            valeurs |= bit
+    return valeurs, definis
 
-RÈGLES D'EXTRACTION :
-- true  = avis POSITIF explicite (ex: "je veux", "j'aime", "avec")
-- false = avis NÉGATIF explicite (ex: "pas de", "sans", "éviter")
-- null  = critère NON mentionné dans le message
 
+# =============================
+#   PROMPTS
+# =============================
 
-EXEMPLES :
-- "sport en montagne" → sport=true, montagne=true, autres=null
-- "plage sans sport" → plage=true, sport=false, autres=null
-- "détente" → detente=true, autres=null
+PROMPT_EXTRACTION = """Tu es un extracteur de critères de voyage.
+Renseigne chaque critère du schéma : true si souhaité explicitement, false si refusé explicitement ("pas de", "sans", "éviter"), null s'il n'est pas mentionné.
+Exemple : "plage sans sport" → plage=true, sport=false, autres=null
 
 Message utilisateur :
-"{message}"
-
-Réponds UNIQUEMENT avec un JSON valide au format Criteres."""
+"{message}\""""
 
 PROMPT_CLARIFICATION = """Je n'ai pas identifié de critères clairs dans votre message.
 
@@ -212,141 +332,306 @@ Par exemple :
 - Ajouter plus de détails
 - Choisir entre plusieurs options"""
 
+PROMPT_ERREUR_EXTRACTION = """Je rencontre un problème technique pour analyser votre demande.
+
+Pourriez-vous reformuler votre demande en précisant vos préférences parmi :
+- Plage
+- Montagne  
+- Ville
+- Sport
+- Détente
+- Accessibilité PMR
+
+Exemple : "Je cherche un séjour à la plage avec détente" """
+
+PROMPT_SECOURS_GENERATION = """Je vous recommande : {nom}
+
+Ce voyage correspond à vos critères. Malheureusement, je rencontre un problème technique pour générer une description détaillée.
+
+Caractéristiques :
+- Type: {labels}
+- Accessibilité PMR: {accessible}
+
+Souhaitez-vous plus d'informations ou explorer d'autres options ?"""
+
+PROMPT_REPONSE_DETERMINISTE = """Je vous recommande : {nom}
+
+Ce voyage correspond à vos critères.
+
+Caractéristiques :
+- Type: {labels}
+- Accessibilité PMR: {accessible}
+
+Souhaitez-vous préciser pour d'autres idées ?"""
+
+# Réponses gabarit (REPONSES_DETERMINISTES=true) pré-formatées par voyage
+REPONSES_GABARIT = {
+    nom: PROMPT_REPONSE_DETERMINISTE.format(nom=nom, labels=labels, accessible=accessible)
+    for nom, (labels, accessible) in FICHES_VOYAGES.items()
+}
+
+# Réponses de secours pré-formatées une fois par voyage (nom → texte)
+REPONSES_SECOURS = {
+    nom: PROMPT_SECOURS_GENERATION.format(nom=nom, labels=labels, accessible=accessible)
+    for nom, (labels, accessible) in FICHES_VOYAGES.items()
+}
+
+
+# Pré-découpage des prompts à l'import : seules les valeurs dynamiques sont
+# insérées à chaque tour (pas de ré-analyse du template par str.format)
+_PROMPT_EXTRACTION_PREFIX, _PROMPT_EXTRACTION_SUFFIX = PROMPT_EXTRACTION.split("{message}")
+
+_PROMPT_GENERATION_PARTS = tuple(
+    (texte, champ) for texte, champ, _, _ in Formatter().parse(PROMPT_GENERATION)
+)
+
+
+def _remplir_prompt(parties: tuple, **valeurs: Any) -> str:
+    """Assemble un prompt pré-découpé (équivalent à template.format(**valeurs))"""
+    return "".join([
+        texte if champ is None else texte + str(valeurs[champ])
+        for texte, champ in parties
+    ])
+
+
+# =============================
+#   CACHE DES RÉPONSES LLM
+# =============================
+
+# Nombre maximal d'entrées conservées par cache (extraction / génération)
+TAILLE_CACHE_LLM = 256
+
+# Durée de validité des entrées (secondes) : le schéma d'extraction est
+# stable, les réponses rédigées sont renouvelées plus souvent
+TTL_CACHE_EXTRACTION = 24 * 3600
+TTL_CACHE_GENERATION = 4 * 3600
+
+
+class CacheLRU:
+    """Cache LRU en mémoire, avec expiration, pour éviter un aller-retour LLM
+    sur une demande déjà vue
+    """
+
+    def __init__(self, taille_max: int, ttl: float):
+        """Crée un cache de taille_max entrées, valables ttl secondes"""
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self._entrees: OrderedDict = OrderedDict()
+
+    def get(self, cle: Any) -> Optional[Any]:
+        """Retourne la valeur en cache (ou None si absente / expirée)"""
+        entree = self._entrees.get(cle)
+        if entree is None:
+            return None
+        expiration, valeur = entree
+        if expiration < time.monotonic():
+            del self._entrees[cle]
+            return None
+        self._entrees.move_to_end(cle)
+        return valeur
+
+    def set(self, cle: Any, valeur: Any) -> None:
+        """Ajoute une valeur, en évinçant la plus ancienne si le cache est plein"""
+        self._entrees[cle] = (time.monotonic() + self.ttl, valeur)
+        self._entrees.move_to_end(cle)
+        if len(self._entrees) > self.taille_max:
+            self._entrees.popitem(last=False)
+
+
+# Message normalisé → valeurs des critères (dans l'ordre de _CRITERE_FIELDS)
+CACHE_EXTRACTION = CacheLRU(TAILLE_CACHE_LLM, TTL_CACHE_EXTRACTION)
+# (voyage, critères, message normalisé) → réponse conseiller
+CACHE_GENERATION = CacheLRU(TAILLE_CACHE_LLM, TTL_CACHE_GENERATION)
+
+
+def normaliser_message(message: str) -> str:
+    """Clé de cache : casse et espaces ignorés"""
+    return " ".join(message.lower().split())
+
+
+# =============================
+#   EXTRACTION DÉTERMINISTE (sans LLM)
+# =============================
+# Messages courts composés uniquement de mots-clés sans ambiguïté et de mots
+# de liaison : les critères sont déduits directement, sans appel au modèle.
+# Tout autre mot (négation, nuance, lieu...) renvoie vers l'extraction LLM.
+
+LONGUEUR_MAX_MOTS_CLES = 60
+
+MOTS_CLES_CRITERES = {
+    "plage": "plage",
+    "mer": "plage",
+    "océan": "plage",
+    "montagne": "montagne",
+    "ville": "ville",
+    "sport": "sport",
+    "détente": "detente",
+    "detente": "detente",
+    "repos": "detente",
+    "spa": "detente",
+    "pmr": "acces_handicap",
+}
+
+MOTS_NEUTRES = frozenset({
+    "je", "j", "veux", "voudrais", "aimerais", "aime", "cherche", "souhaite",
+    "un", "une", "des", "de", "du", "la", "le", "les", "l", "d",
+    "à", "a", "au", "aux", "en", "et", "avec", "bord", "plutôt",
+    "vacances", "séjour", "voyage",
+})
+
+_RE_MOTS = re.compile(r"\w+")
+
+
+def extraire_criteres_mots_cles(message_normalise: str) -> Optional[Dict[str, Optional[bool]]]:
+    """Déduit les critères d'un message trivial, ou None si le LLM est nécessaire"""
+    if len(message_normalise) > LONGUEUR_MAX_MOTS_CLES:
+        return None
+    
+    criteres = _CRITERES_VIDES.copy()
+    trouve = False
+    for mot in _RE_MOTS.findall(message_normalise):
+        critere = MOTS_CLES_CRITERES.get(mot)
+        if critere is not None:
+            criteres[critere] = True
+            trouve = True
+        elif mot not in MOTS_NEUTRES:
+            return None
+    
+    return criteres if trouve else None
+
 
 # =============================
 #   FONCTIONS UTILITAIRES
 # =============================
 
-@traceable(name="match_criteres")
-def match_criteres(voyage: Dict, criteres: Dict) -> bool:
-    """Vérifie si un voyage correspond aux critères (logique simple)
+# Fenêtre de regroupement des tokens streamés (secondes)
+STREAM_FLUSH_SECONDS = 0.2
+
+
+def _writer_inactif(_morceau: Any) -> None:
+    """Writer sans effet, utilisé hors d'une exécution LangGraph"""
+
+
+def _get_writer():
+    """Retourne le writer de flux LangGraph, ou un writer inactif
     
-    Tracé dans LangSmith pour analyser la logique de matching
+    Hors d'une exécution du graphe (script, test, appel direct),
+    get_stream_writer() lève RuntimeError : la génération doit quand même
+    appeler le modèle au lieu de tomber dans la réponse de secours.
     """
-    for critere, valeur in criteres.items():
-        if valeur is None:
-            continue
-        
-        # Cas spécial : accessibilité handicap
-        if critere == "acces_handicap":
-            if valeur != voyage.get("accessibleHandicap", False):
-                return False
-        else:
-            # Mapping critère → labels attendus
-            label_map = {
-                "plage": ["plage"],
-                "montagne": ["montagne"],
-                "ville": ["ville"],
-                "sport": ["sport"],
-                "detente": ["detente", "détente"]
-            }
-            labels_requis = label_map.get(critere, [])
-            has_label = any(l in voyage["labels"] for l in labels_requis)
-            
-            # Si critère = True, le voyage doit avoir le label
-            if valeur and not has_label:
-                return False
-            # Si critère = False, le voyage ne doit PAS avoir le label
-            if not valeur and has_label:
-                return False
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return _writer_inactif
+
+
+def match_criteres(masque: int, valeurs: int, definis: int) -> bool:
+    """Vérifie si un voyage (masque labels + accessibilité) correspond aux critères
     
-    return True
+    Un critère renseigné doit avoir la même valeur que le bit du voyage :
+    True → bit présent, False → bit absent. Non tracé : appelé pour chaque
+    voyage, le span agrégé est trouver_voyage
+    """
+    return ((masque ^ valeurs) & definis) == 0
 
 
 @traceable(name="trouver_voyage")
-def trouver_voyage(criteres: Dict) -> Optional[Dict]:
+def trouver_voyage(criteres: Dict) -> Optional[Dict[str, Any]]:
     """Retourne le voyage correspondant le mieux aux critères
     
     Tracé dans LangSmith pour analyser le processus de sélection
     """
-    # Trouver tous les voyages compatibles
-    matches = []
-    for voyage in VOYAGES:
-        if match_criteres(voyage, criteres):
-            matches.append(voyage)
+    # Masques calculés une seule fois pour tous les voyages
+    valeurs, definis = masques_criteres(criteres)
+    requis = valeurs & ~BIT_ACCES
+    acces_demande = valeurs & BIT_ACCES
     
-    if not matches:
-        return None
-    
-    # Si un seul match, le retourner
-    if len(matches) == 1:
-        return matches[0]
-    
-    # Scoring : favoriser précision et éviter le "bruit"
-    def score_voyage(voyage: Dict) -> tuple:
-        criteres_actifs = {k: v for k, v in criteres.items() if v is True}
-        
-        # Mapping critère → label
-        label_map = {
-            "plage": "plage",
-            "montagne": "montagne",
-            "ville": "ville",
-            "sport": "sport",
-            "detente": "detente"
-        }
-        
-        # Compter les correspondances
-        matches_count = 0
-        for crit in criteres_actifs:
-            label = label_map.get(crit)
-            if label and label in voyage["labels"]:
-                matches_count += 1
-        
-        # Compter les labels "pertinents" (ceux dans label_map)
-        relevant_labels = [l for l in voyage["labels"] if l in label_map.values()]
-        total_relevant = len(relevant_labels)
-        
-        # Bonus accessibilité si demandée
-        acces_bonus = 0
-        if criteres.get("acces_handicap") is True and voyage.get("accessibleHandicap"):
-            acces_bonus = 1
+    # Un seul passage : matching + scoring, en gardant le meilleur voyage
+    # Score : (correspondances, -labels_superflus, accessibilité)
+    # Le "-" inverse pour favoriser MOINS de labels superflus
+    best = None
+    best_score = None
+    for voyage, (masque, pertinents) in zip(VOYAGES, VOYAGE_MASKS):
+        if not match_criteres(masque, valeurs, definis):
+            continue
         
-        # Score : (correspondances, -labels_superflus, accessibilité)
-        # Le "-" inverse pour favoriser MOINS de labels superflus
-        return (matches_count, -total_relevant, acces_bonus)
+        score = (
+            (masque & requis).bit_count(),
+            -pertinents,
+            1 if masque & acces_demande else 0,
+        )
+        # ">" strict : à score égal, le premier voyage du catalogue est conservé
+        if best_score is None or score > best_score:
+            best = voyage
+            best_score = score
     
-    # Retourner le voyage avec le meilleur score (tuple comparé élément par élément)
-    best = max(matches, key=score_voyage)
     return best
 
 
 @traceable(name="generer_reponse_llm")
-async def generer_reponse_llm(voyage: Dict, criteres: Dict, message: str) -> str:
+async def generer_reponse_llm(voyage: Dict[str, Any], criteres: Dict, message: str,
+                              message_normalise: str) -> str:
     """Génère une réponse naturelle avec le LLM
     
     Tracé dans LangSmith pour monitorer les appels LLM et réponses
+    
+    Note: si le flux échoue en cours de route, les morceaux déjà poussés
+    (stream_mode="custom") sont à ignorer : la réponse finale
+    (dernier_message_ia) est alors le texte de secours.
     """
+    # Réponse déjà générée pour ce voyage, ces critères et ce message ?
+    cle_generation = (voyage["nom"], tuple(criteres.values()), message_normalise)
+    reponse_en_cache = CACHE_GENERATION.get(cle_generation)
+    
+    writer = _get_writer()
+    
     try:
-        model = init_chat_model("mistral-small-latest", model_provider="mistralai")
+        if reponse_en_cache is not None:
+            print(f"♻️  Réponse servie depuis le cache: {voyage['nom']}")
+            writer({"message_ia_partiel": reponse_en_cache})
+            return reponse_en_cache
+        
+        model = _get_generation_model()
         
         # Filtrer les critères actifs (non-None)
         criteres_actifs = {k: v for k, v in criteres.items() if v is not None}
         
-        prompt = PROMPT_GENERATION.format(
+        labels, accessible = FICHES_VOYAGES[voyage["nom"]]
+        prompt = _remplir_prompt(
+            _PROMPT_GENERATION_PARTS,
             message=message,
             criteres=criteres_actifs,
             nom=voyage["nom"],
-            labels=", ".join(voyage["labels"]),
-            accessible="Oui" if voyage["accessibleHandicap"] else "Non"
+            labels=labels,
+            accessible=accessible
         )
         
-        response = await model.ainvoke(prompt)
-        return response.content
+        # Streaming : les tokens sont regroupés par fenêtre de temps avant
+        # d'être poussés (stream_mode="custom") pour limiter le coût par chunk
+        morceaux = []
+        tampon = []
+        dernier_envoi = time.monotonic()
+        async for chunk in model.astream(prompt):
+            morceaux.append(chunk.content)
+            tampon.append(chunk.content)
+            maintenant = time.monotonic()
+            if maintenant - dernier_envoi >= STREAM_FLUSH_SECONDS:
+                writer({"message_ia_partiel": "".join(tampon)})
+                tampon.clear()
+                dernier_envoi = maintenant
+        if tampon:
+            writer({"message_ia_partiel": "".join(tampon)})
+        
+        reponse = "".join(morceaux)
+        CACHE_GENERATION.set(cle_generation, reponse)
+        return reponse
     
     except Exception as e:
         # Log de l'erreur pour le débogage
         print(f"❌ Erreur lors de la génération de réponse: {type(e).__name__}: {str(e)}")
         
-        # Retourner une réponse de secours user-friendly
-        return f"""Je vous recommande : {voyage['nom']}
-
-Ce voyage correspond à vos critères. Malheureusement, je rencontre un problème technique pour générer une description détaillée.
-
-Caractéristiques :
-- Type: {', '.join(voyage['labels'])}
-- Accessibilité PMR: {'Oui' if voyage['accessibleHandicap'] else 'Non'}
-
-Souhaitez-vous plus d'informations ou explorer d'autres options ?"""
+        # Retourner une réponse de secours user-friendly (pré-formatée)
+        return REPONSES_SECOURS[voyage["nom"]]
 
 
 # =============================
@@ -373,46 +658,53 @@ async def process_message(state: State) -> Dict[str, Any]:
     """
     message = state.dernier_message_utilisateur
     
+    # 0. COURT-CIRCUIT : message vide → aucun critère possible, pas d'appel LLM
+    if not message.strip():
+        print("⚠️  Message vide - Demande de clarification")
+        return {
+            "dernier_message_ia": PROMPT_CLARIFICATION,
+            "criteres": _CRITERES_VIDES.copy()
+        }
+    
     # 1. EXTRACTION avec structured output
+    # (sauf si message déjà vu, ou message trivial résolu par mots-clés)
+    cle_extraction = normaliser_message(message)
+    valeurs_en_cache = CACHE_EXTRACTION.get(cle_extraction)
+    criteres_mots_cles = (
+        extraire_criteres_mots_cles(cle_extraction) if valeurs_en_cache is None else None
+    )
     try:
-        model = init_chat_model("mistral-small-latest", model_provider="mistralai")
-        model_struct = model.with_structured_output(Criteres)
-        
-        prompt_extraction = PROMPT_EXTRACTION.format(message=message)
-        extraits = await model_struct.ainvoke(prompt_extraction)
-        
-        # Log des critères extraits (visible dans LangSmith)
-        print(f"📊 Critères extraits: {extraits.dict()}")
+        if valeurs_en_cache is not None:
+            criteres_extraits = dict(zip(_CRITERE_FIELDS, valeurs_en_cache))
+            print(f"📊 Critères extraits (cache): {criteres_extraits}")
+        elif criteres_mots_cles is not None:
+            criteres_extraits = criteres_mots_cles
+            print(f"📊 Critères extraits (mots-clés): {criteres_extraits}")
+        else:
+            model_struct = _get_struct_model()
+            
+            prompt_extraction = f"{_PROMPT_EXTRACTION_PREFIX}{message}{_PROMPT_EXTRACTION_SUFFIX}"
+            extraits = await model_struct.ainvoke(prompt_extraction)
+            criteres_extraits = {k: getattr(extraits, k) for k in _CRITERE_FIELDS}
+            CACHE_EXTRACTION.set(cle_extraction, tuple(criteres_extraits.values()))
+            
+            # Log des critères extraits (visible dans LangSmith)
+            print(f"📊 Critères extraits: {criteres_extraits}")
     
     except Exception as e:
         # Log de l'erreur pour le débogage
         print(f"❌ Erreur lors de l'extraction des critères: {type(e).__name__}: {str(e)}")
         
         # En cas d'erreur d'extraction, retourner un message d'erreur user-friendly
-        message_erreur = """Je rencontre un problème technique pour analyser votre demande.
-
-Pourriez-vous reformuler votre demande en précisant vos préférences parmi :
-- Plage
-- Montagne  
-- Ville
-- Sport
-- Détente
-- Accessibilité PMR
-
-Exemple : "Je cherche un séjour à la plage avec détente" """
-        
         return {
-            "dernier_message_ia": message_erreur,
-            "criteres": {k: None for k in state.criteres}
+            "dernier_message_ia": PROMPT_ERREUR_EXTRACTION,
+            "criteres": _CRITERES_VIDES.copy()
         }
     
-    # 2. RESET OBLIGATOIRE des critères (pas d'héritage entre tours)
-    nouveaux_criteres = {k: None for k in state.criteres}
-    
-    # 3. APPLICATION des nouveaux critères extraits
-    for k, v in extraits.dict().items():
-        if v is not None:
-            nouveaux_criteres[k] = v
+    # 2-3. RESET OBLIGATOIRE + APPLICATION des critères extraits
+    # criteres_extraits couvre déjà les 6 clés (None si non mentionné) :
+    # aucun héritage du tour précédent, pas de second dictionnaire à remplir
+    nouveaux_criteres = criteres_extraits
     
     # 4. VALIDATION : aucun critère rempli ?
     if all(v is None for v in nouveaux_criteres.values()):
@@ -427,8 +719,16 @@ Exemple : "Je cherche un séjour à la plage avec détente" """
     
     if voyage:
         print(f"✅ Voyage trouvé: {voyage['nom']}")
-        # Génération réponse avec LLM
-        message_ia = await generer_reponse_llm(voyage, nouveaux_criteres, message)
+        if REPONSES_DETERMINISTES:
+            # Réponse gabarit : le voyage est déjà choisi, pas d'appel LLM
+            # (poussée une fois sur le flux, comme une réponse en cache)
+            message_ia = REPONSES_GABARIT[voyage["nom"]]
+            _get_writer()({"message_ia_partiel": message_ia})
+        else:
+            # Génération réponse avec LLM
+            message_ia = await generer_reponse_llm(
+                voyage, nouveaux_criteres, message, cle_extraction
+            )
     else:
         print("❌ Aucun voyage correspondant aux critères")
         # Aucun voyage ne correspond
@@ -444,14 +744,10 @@ Exemple : "Je cherche un séjour à la plage avec détente" """
 #   CONSTRUCTION DU GRAPHE
 # =============================
 
-def build_graph():
-    """Construit le graphe LangGraph minimaliste
-    
-    Le graphe sera automatiquement tracé dans LangSmith via langgraph dev
+def _compiler_graphe(checkpointer=None):
+    """Compile le StateGraph à nœud unique (sans mémorisation)"""
+    _configurer()
     
-    Note: Pas de checkpointer défini ici car langgraph dev gère 
-    automatiquement la persistance via sa plateforme.
-    """
     workflow = StateGraph(State)
     
     # 1 seul nœud
@@ -461,15 +757,39 @@ def build_graph():
     workflow.set_entry_point("process_message")
     workflow.add_edge("process_message", END)
     
-    # Compilation SANS checkpointer - géré automatiquement par langgraph dev
-    graph = workflow.compile(name="Agent Voyage Examen")
+    # Compilation SANS checkpointer par défaut - géré automatiquement par langgraph dev
+    graph = workflow.compile(checkpointer=checkpointer, name="Agent Voyage Examen")
     
     if LANGSMITH_ENABLED:
         print("🔍 Graphe compilé - Traçage actif dans LangSmith")
-        print("💾 Persistance gérée automatiquement par LangGraph API")
+        if checkpointer is None:
+            print("💾 Persistance gérée automatiquement par LangGraph API")
     
     return graph
 
 
+@lru_cache(maxsize=1)
+def _graphe_par_defaut():
+    """Graphe sans checkpointer, compilé une seule fois"""
+    return _compiler_graphe()
+
+
+def build_graph(checkpointer=None):
+    """Construit le graphe LangGraph minimaliste
+    
+    Le graphe sera automatiquement tracé dans LangSmith via langgraph dev
+    
+    Note: Pas de checkpointer par défaut car langgraph dev gère 
+    automatiquement la persistance via sa plateforme. Un checkpointer peut
+    être fourni pour un usage local (ex: démo multi-tours avec MemorySaver).
+    Seul le graphe sans checkpointer est mémorisé : avec un checkpointer,
+    chaque appel compile un nouveau graphe (aucune référence gardée en cache
+    sur le checkpointer et son historique de conversation).
+    """
+    if checkpointer is None:
+        return _graphe_par_defaut()
+    return _compiler_graphe(checkpointer)
+
+
 # Export pour langgraph dev
 graph = build_graph()
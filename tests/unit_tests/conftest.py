@@ -0,0 +1,5 @@
+import os
+
+# agent.graph vérifie la clé Mistral à l'import (export `graph`) : une valeur
+# factice suffit, les tests unitaires n'appellent pas le modèle
+os.environ.setdefault("MISTRAL_API_KEY", "test")
@@ -0,0 +1,34 @@
+import time
+
+from agent.graph import CacheLRU
+
+
+# =============================
+#   CACHE LRU
+# =============================
+
+def test_cache_lru_eviction():
+    cache = CacheLRU(taille_max=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" devient le plus récent
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_cache_lru_expiration(monkeypatch):
+    horloge = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: horloge[0])
+    cache = CacheLRU(taille_max=2, ttl=10)
+    cache.set("a", 1)
+    horloge[0] += 9
+    assert cache.get("a") == 1
+    horloge[0] += 2
+    assert cache.get("a") is None
+    # Une entrée expirée reste absente ; une nouvelle écriture repart pour un TTL complet
+    horloge[0] += 1
+    assert cache.get("a") is None
+    cache.set("a", 2)
+    assert cache.get("a") == 2
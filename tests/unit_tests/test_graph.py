@@ -0,0 +1,138 @@
+import importlib
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from agent.graph import CacheLRU, State, extraire_criteres_mots_cles, normaliser_message
+
+# Le module (et non l'export `graph` compilé) pour remplacer modèles et caches
+graph_module = importlib.import_module("agent.graph")
+
+CRITERES = ("plage", "montagne", "ville", "sport", "detente", "acces_handicap")
+
+# "plage" est résolu par mots-clés et ne correspond qu'à ce voyage
+VOYAGE_PLAGE = "Palavas de paillotes en paillotes"
+REPONSE_MODELE = f"Je vous recommande {VOYAGE_PLAGE}, au bord de la mer."
+
+
+@pytest.fixture
+def caches_vides(monkeypatch):
+    monkeypatch.setattr(graph_module, "CACHE_EXTRACTION", CacheLRU(8, 60))
+    monkeypatch.setattr(graph_module, "CACHE_GENERATION", CacheLRU(8, 60))
+
+
+@pytest.fixture
+def appels_modeles(monkeypatch):
+    """Remplace les modèles par des faux et compte leurs appels"""
+    appels = {"generation": 0, "extraction": 0}
+
+    def faux_modele_generation():
+        appels["generation"] += 1
+        return GenericFakeChatModel(messages=iter([AIMessage(content=REPONSE_MODELE)]))
+
+    def faux_modele_extraction():
+        appels["extraction"] += 1
+        raise AssertionError("extraction LLM inattendue")
+
+    monkeypatch.setattr(graph_module, "_get_generation_model", faux_modele_generation)
+    monkeypatch.setattr(graph_module, "_get_struct_model", faux_modele_extraction)
+    return appels
+
+
+async def _executer_graphe(message):
+    """Exécute le graphe par défaut : (morceaux du flux custom, état final)"""
+    morceaux, etat = [], None
+    async for mode, chunk in graph_module.build_graph().astream(
+        State(dernier_message_utilisateur=message), stream_mode=["custom", "values"]
+    ):
+        if mode == "custom":
+            morceaux.append(chunk["message_ia_partiel"])
+        else:
+            etat = chunk
+    return morceaux, etat
+
+
+# =============================
+#   EXTRACTION PAR MOTS-CLÉS
+# =============================
+
+@pytest.mark.parametrize(
+    "message, attendus",
+    [
+        ("Plage", {"plage": True}),
+        ("Je cherche la mer et le spa", {"plage": True, "detente": True}),
+        ("montagne  avec   sport", {"montagne": True, "sport": True}),
+        ("ville pmr", {"ville": True, "acces_handicap": True}),
+    ],
+)
+def test_mots_cles_positifs(message, attendus):
+    criteres = extraire_criteres_mots_cles(normaliser_message(message))
+    assert criteres == {c: attendus.get(c) for c in CRITERES}
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "pas de plage",
+        "sans sport",
+        "je n'aime pas la mer",
+        "bonjour",
+        "Un séjour en ville, accessible PMR",
+        "",
+        "plage " * 20,
+    ],
+)
+def test_mots_cles_renvoie_vers_llm(message):
+    assert extraire_criteres_mots_cles(normaliser_message(message)) is None
+
+
+# =============================
+#   NŒUD process_message
+# =============================
+
+@pytest.mark.anyio
+async def test_message_vide_demande_clarification(caches_vides, appels_modeles):
+    resultat = await graph_module.process_message(State(dernier_message_utilisateur="   "))
+
+    assert resultat["dernier_message_ia"] == graph_module.PROMPT_CLARIFICATION
+    assert resultat["criteres"] == dict.fromkeys(CRITERES)
+    assert appels_modeles == {"generation": 0, "extraction": 0}
+
+
+# =============================
+#   GÉNÉRATION ET FLUX
+# =============================
+
+@pytest.mark.anyio
+async def test_generation_hors_graphe_appelle_le_modele(caches_vides, appels_modeles):
+    voyage = next(v for v in graph_module.VOYAGES if v["nom"] == VOYAGE_PLAGE)
+    criteres = {**dict.fromkeys(CRITERES), "plage": True}
+
+    reponse = await graph_module.generer_reponse_llm(voyage, criteres, "Plage", "plage")
+
+    assert reponse == REPONSE_MODELE
+    assert reponse != graph_module.REPONSES_SECOURS[VOYAGE_PLAGE]
+    assert appels_modeles["generation"] == 1
+    cle = (VOYAGE_PLAGE, tuple(criteres.values()), "plage")
+    assert graph_module.CACHE_GENERATION.get(cle) == REPONSE_MODELE
+
+
+@pytest.mark.anyio
+async def test_flux_custom_reconstitue_la_reponse(caches_vides, appels_modeles):
+    morceaux, etat = await _executer_graphe("plage")
+
+    assert etat["dernier_message_ia"] == REPONSE_MODELE
+    assert "".join(morceaux) == etat["dernier_message_ia"]
+    assert appels_modeles == {"generation": 1, "extraction": 0}
+
+
+@pytest.mark.anyio
+async def test_reponse_gabarit_sans_appel_llm(monkeypatch, caches_vides, appels_modeles):
+    monkeypatch.setattr(graph_module, "REPONSES_DETERMINISTES", True)
+
+    morceaux, etat = await _executer_graphe("plage")
+
+    assert etat["dernier_message_ia"] == graph_module.REPONSES_GABARIT[VOYAGE_PLAGE]
+    assert morceaux == [etat["dernier_message_ia"]]
+    assert appels_modeles == {"generation": 0, "extraction": 0}
@@ -0,0 +1,53 @@
+import itertools
+
+from agent.graph import VOYAGES, trouver_voyage
+
+CRITERES = ("plage", "montagne", "ville", "sport", "detente", "acces_handicap")
+
+
+# =============================
+#   MATCHING DU CATALOGUE
+# =============================
+
+def _trouver_voyage_reference(criteres):
+    """Implémentation d'origine (dicts, sans masques) servant de référence"""
+    label_map = {
+        "plage": ["plage"],
+        "montagne": ["montagne"],
+        "ville": ["ville"],
+        "sport": ["sport"],
+        "detente": ["detente", "détente"],
+    }
+
+    def correspond(voyage):
+        for critere, valeur in criteres.items():
+            if valeur is None:
+                continue
+            if critere == "acces_handicap":
+                if valeur != voyage.get("accessibleHandicap", False):
+                    return False
+            else:
+                has_label = any(label in voyage["labels"] for label in label_map[critere])
+                if valeur != has_label:
+                    return False
+        return True
+
+    def score(voyage):
+        correspondances = sum(
+            1 for c, v in criteres.items()
+            if v is True and c != "acces_handicap" and c in voyage["labels"]
+        )
+        pertinents = sum(1 for label in voyage["labels"] if label in label_map)
+        bonus = 1 if criteres.get("acces_handicap") is True and voyage["accessibleHandicap"] else 0
+        return (correspondances, -pertinents, bonus)
+
+    matches = [v for v in VOYAGES if correspond(v)]
+    return max(matches, key=score) if matches else None
+
+
+def test_trouver_voyage_equivalent_reference():
+    for valeurs in itertools.product((None, True, False), repeat=len(CRITERES)):
+        criteres = dict(zip(CRITERES, valeurs))
+        attendu = _trouver_voyage_reference(criteres)
+        obtenu = trouver_voyage(criteres)
+        assert obtenu is attendu, criteres